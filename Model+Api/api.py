@@ -6,11 +6,14 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import numpy as np
-import pandas as pd
-from scipy import signal
 from scipy.stats import skew, kurtosis
 from catboost import CatBoostClassifier
 
+from signal_kernels import (
+    FEATURE_COLS,
+    acc_mag_stats, bandpower, diff_mean_std, find_peaks_distance, hrv_features
+)
+
 
 # =========================================================
 # Load CatBoost model
@@ -21,6 +24,20 @@ MODEL_PATH = r"D:\Graduation Project Dataset\archive\WESAD\catboost_wrist_stress
 model = CatBoostClassifier()
 model.load_model(MODEL_PATH)
 
+# Fixed noise template for the synthetic 6-second window: drawn once at
+# startup (seeded, so predictions are reproducible across restarts) and
+# shifted by the input values on every request
+NOISE_SEED = 42
+_z = np.random.default_rng(NOISE_SEED).standard_normal(384 + 5 * 192)
+NOISE = {
+    "BVP": 0.01 * _z[:384],
+    "EDA": 0.02 * _z[384:576],
+    "TEMP": 0.005 * _z[576:768],
+    "ACC_x": 2 * _z[768:960],
+    "ACC_y": 2 * _z[960:1152],
+    "ACC_z": 2 * _z[1152:1344],
+}
+
 
 # =========================================================
 # FastAPI setup
@@ -49,14 +66,12 @@ class SensorInput(BaseModel):
 
 
 # =========================================================
-# Bandpower helper
+# Feature order (shared with the training columns)
 # =========================================================
-def bandpower(arr, fs, low, high):
-    freqs, psd = signal.welch(arr, fs=fs, nperseg=len(arr))
-    mask = (freqs >= low) & (freqs <= high)
-    if not np.any(mask):
-        return 0.0
-    return float(np.trapezoid(psd[mask], freqs[mask]))
+# 'index' comes from reset_index() in training and is always 0 here
+FEATURE_ORDER = ["index"] + FEATURE_COLS
+
+COL_IDX = {name: i for i, name in enumerate(FEATURE_ORDER)}
 
 
 # =========================================================
@@ -144,11 +159,11 @@ def extract_features_window(signals):
     row["EDA_skew"] = float(skew(eda))
     row["EDA_kurt"] = float(kurtosis(eda))
 
-    eda_diff = np.diff(eda)
-    row["EDA_diff_mean"] = float(np.mean(eda_diff))
-    row["EDA_diff_std"] = float(np.std(eda_diff))
+    diff_mean, diff_std = diff_mean_std(eda)
+    row["EDA_diff_mean"] = float(diff_mean)
+    row["EDA_diff_std"] = float(diff_std)
 
-    peaks, _ = signal.find_peaks(eda, distance=16)
+    peaks = find_peaks_distance(eda, 16)
     row["EDA_peak_count"] = len(peaks)
     row["EDA_peak_mean_amp"] = float(np.mean(eda[peaks])) if len(peaks) else 0.0
 
@@ -168,17 +183,10 @@ def extract_features_window(signals):
     row["TEMP_slope"] = float(temp[-1] - temp[0]) / len(temp)
 
     # ---------- ACC ----------
-    ax, ay, az = signals["ACC_x"], signals["ACC_y"], signals["ACC_z"]
-    mag = np.sqrt(ax**2 + ay**2 + az**2)
-
-    row["ACC_mag_mean"] = float(np.mean(mag))
-    row["ACC_mag_std"] = float(np.std(mag))
-    row["ACC_mag_min"] = float(np.min(mag))
-    row["ACC_mag_max"] = float(np.max(mag))
-    row["ACC_mag_median"] = float(np.median(mag))
-    row["ACC_mag_skew"] = float(skew(mag))
-    row["ACC_mag_kurt"] = float(kurtosis(mag))
-    row["ACC_energy"] = float(np.sum(mag**2) / len(mag))
+    acc_stats = acc_mag_stats(signals["ACC_x"], signals["ACC_y"], signals["ACC_z"])
+    for k, v in zip(["ACC_mag_mean", "ACC_mag_std", "ACC_mag_min", "ACC_mag_max",
+                     "ACC_mag_median", "ACC_mag_skew", "ACC_mag_kurt", "ACC_energy"], acc_stats):
+        row[k] = float(v)
 
     # ---------- BVP ----------
     bvp = signals["BVP"]
@@ -191,20 +199,21 @@ def extract_features_window(signals):
     row["BVP_kurt"] = float(kurtosis(bvp))
 
     # ---------- HRV ----------
-    peaks, _ = signal.find_peaks(bvp, distance=20)
-    if len(peaks) > 1:
-        ibi = np.diff(peaks) / 64.0
-        rr_diff = np.diff(ibi)
-
-        row["HR_mean"] = float(60.0 / np.mean(ibi))
-        row["HRV_SDNN"] = float(np.std(ibi))
-        row["HRV_RMSSD"] = float(np.sqrt(np.mean(rr_diff**2))) if len(rr_diff) else 0.0
-        row["HRV_pNN50"] = float(np.sum(np.abs(rr_diff) > 0.05)) / len(rr_diff) if len(rr_diff) else 0.0
+    hr, sdnn, rmssd, pnn50, ibi = hrv_features(bvp, 64.0, 20)
+    if len(ibi) > 0:
+        row["HR_mean"] = float(hr)
+        row["HRV_SDNN"] = float(sdnn)
+        row["HRV_RMSSD"] = float(rmssd)
+        row["HRV_pNN50"] = float(pnn50)
 
         try:
-            times = np.cumsum(ibi)
-            interp_times = np.linspace(times[0], times[-1], len(times))
-            ibi_interp = np.interp(interp_times, times, ibi)
+            # Equal IBIs (sdnn < 1ms) are already on a uniform grid
+            if sdnn < 1e-3:
+                ibi_interp = ibi
+            else:
+                times = np.cumsum(ibi)
+                interp_times = np.linspace(times[0], times[-1], len(times))
+                ibi_interp = np.interp(interp_times, times, ibi)
 
             row["HRV_LF"] = bandpower(ibi_interp, 4, 0.04, 0.15)
             row["HRV_HF"] = bandpower(ibi_interp, 4, 0.15, 0.40)
@@ -219,67 +228,66 @@ def extract_features_window(signals):
 
 
 # =========================================================
-# Prediction Endpoint
+# Startup warm-up
 # =========================================================
-@app.post("/predict")
-def predict_stress(input: SensorInput):
+@app.on_event("startup")
+def warmup():
+    """
+    Runs the feature extractor once so the Numba kernels are compiled
+    (or loaded from their on-disk cache) before the first real request.
+    """
+    base = {"BVP": 0.0, "EDA": 1.0, "TEMP": 36.0, "ACC_x": 0.0, "ACC_y": 0.0, "ACC_z": 0.0}
+    extract_features_window({k: NOISE[k] + v for k, v in base.items()})
 
-    try:
-        # 1️⃣ Physiological override (avoid false stress)
-        if (
-            36.0 <= input.TEMP <= 37.5 and
-            input.EDA <= 3.0 and
-            abs(input.ACC_x) < 50 and
-            abs(input.ACC_y) < 50 and
-            abs(input.ACC_z) < 50
-        ):
-            return {
-                "prediction": "NOT STRESSED",
-                "probability": 0.0,
-                "advice": "Your vital signs appear normal. Everything looks stable."
-            }
-
-        # 2️⃣ Build synthetic 6-second window
-        signals = {
-            "BVP": input.BVP + 0.01 * np.random.randn(384),
-            "EDA": input.EDA + 0.02 * np.random.randn(192),
-            "TEMP": input.TEMP + 0.005 * np.random.randn(192),
-            "ACC_x": input.ACC_x + 2 * np.random.randn(192),
-            "ACC_y": input.ACC_y + 2 * np.random.randn(192),
-            "ACC_z": input.ACC_z + 2 * np.random.randn(192),
-        }
 
-        # 3️⃣ Extract features
-        features = extract_features_window(signals)
+# =========================================================
+# Physiological override
+# =========================================================
+CALM_RESPONSE = {
+    "prediction": "NOT STRESSED",
+    "probability": 0.0,
+    "advice": "Your vital signs appear normal. Everything looks stable."
+}
 
-        df = pd.DataFrame([features]).fillna(0)
-        df.insert(0, "index", 0)
 
-        # 4️⃣ Correct feature order from the Training
-        order = [
-            'index',
-            'EDA_mean', 'EDA_std', 'EDA_min', 'EDA_max', 'EDA_median', 'EDA_skew', 'EDA_kurt',
-            'EDA_diff_mean', 'EDA_diff_std',
-            'EDA_peak_count', 'EDA_peak_mean_amp',
-            'EDA_LF', 'EDA_HF', 'EDA_LFHF',
+def is_calm(input):
+    """
+    Normal temperature, low EDA and little movement: reported as not
+    stressed without running the model (avoids false stress).
+    """
+    return (
+        36.0 <= input.TEMP <= 37.5 and
+        input.EDA <= 3.0 and
+        max(abs(input.ACC_x), abs(input.ACC_y), abs(input.ACC_z)) < 50
+    )
 
-            'TEMP_mean', 'TEMP_std', 'TEMP_min', 'TEMP_max', 'TEMP_median',
-            'TEMP_skew', 'TEMP_kurt', 'TEMP_slope',
 
-            'ACC_mag_mean', 'ACC_mag_std', 'ACC_mag_min', 'ACC_mag_max',
-            'ACC_mag_median', 'ACC_mag_skew', 'ACC_mag_kurt', 'ACC_energy',
+# =========================================================
+# Prediction Endpoint
+# =========================================================
+@app.post("/predict")
+def predict_stress(input: SensorInput):
+
+    # 1️⃣ Physiological override, checked before any NumPy work
+    if is_calm(input):
+        return dict(CALM_RESPONSE)
 
-            'BVP_mean', 'BVP_std', 'BVP_min', 'BVP_max', 'BVP_median',
-            'BVP_skew', 'BVP_kurt',
+    try:
+        # 2️⃣ Build synthetic 6-second window (input + fixed noise template)
+        signals = {k: NOISE[k] + getattr(input, k) for k in NOISE}
 
-            'HR_mean', 'HRV_SDNN', 'HRV_RMSSD', 'HRV_pNN50',
-            'HRV_LF', 'HRV_HF', 'HRV_LFHF'
-        ]
+        # 3️⃣ Extract features
+        features = extract_features_window(signals)
 
-        df = df[order]
+        # 4️⃣ Write features into a row in the training column order
+        #    ('index' stays 0, NaN features become 0)
+        row = np.zeros((1, len(FEATURE_ORDER)), dtype=np.float32)
+        for k, v in features.items():
+            row[0, COL_IDX[k]] = v
+        row[np.isnan(row)] = 0.0
 
         # 5️⃣ Predict
-        proba = model.predict_proba(df)[0][1]
+        proba = model.predict_proba(row)[0][1]
         # Its now 70% you can easily change it at anytime
         THRESH = 0.70
 
@@ -1,17 +1,28 @@
 import os
 import glob
 import pickle
+import re
+import shutil
 import numpy as np
 import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
 from scipy import signal
+from scipy.stats import skew, kurtosis
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score, classification_report, confusion_matrix
 import warnings
+from joblib import Parallel, delayed
 from scipy.integrate import trapezoid
 
 
 from catboost import CatBoostClassifier
 
+from signal_kernels import (
+    FEATURE_COLS, STAT_NAMES,
+    acc_magnitude, band_mask, bandpower, hrv_features,
+    window_diff_stats, window_peak_stats,
+)
+
 # ----------------------------
 # CONFIG
 # ----------------------------
@@ -25,6 +36,13 @@ DEFAULT_WRIST_SR = 32
 DEFAULT_BVP_SR = 64          # Real BVP sample rate
 ALLOWED_LABELS = [0, 1]
 VERBOSE = True
+N_JOBS = -1                  # subjects processed in parallel (-1 = all cores)
+USE_SUBJECT_CACHE = True     # keep decoded signals as .npy next to each pickle
+CACHE_SUFFIX = "_wrist_cache"
+CACHE_STAMP = "source.txt"   # size/mtime of the pickle the cache was built from
+USE_DASK = False             # dask pipeline for cohorts that do not fit in RAM
+# parquet output of the dask pipeline (owned by it, rewritten on every run)
+FEATURES_DIR = os.path.join(WESAD_PATH, "features_parquet")
 
 def safe_print(*args, **kwargs):
     if VERBOSE:
@@ -35,6 +53,25 @@ def safe_print(*args, **kwargs):
 # LOAD ONE SUBJECT (WRIST ONLY)
 # ----------------------------
 def load_wesad_subject(subject_path):
+    cache_dir = os.path.splitext(subject_path)[0] + CACHE_SUFFIX
+
+    if USE_SUBJECT_CACHE:
+        res = load_subject_cache(cache_dir, subject_path)
+        if res is not None:
+            return res
+
+    res = load_wesad_pickle(subject_path)
+
+    if USE_SUBJECT_CACHE and res is not None:
+        try:
+            save_subject_cache(cache_dir, subject_path, *res)
+        except OSError as e:
+            warnings.warn(f"Could not cache {subject_path}: {e}")
+
+    return res
+
+
+def load_wesad_pickle(subject_path):
     with open(subject_path, "rb") as f:
         data = pickle.load(f, encoding="latin1") # WESAD uses python2 pickles
 
@@ -68,163 +105,333 @@ def load_wesad_subject(subject_path):
     return signals, chest_labels
 
 
+def pickle_stamp(subject_path):
+    # Size + mtime of the source pickle; a changed pickle invalidates the cache
+    st = os.stat(subject_path)
+    return f"{st.st_size} {st.st_mtime_ns}"
+
+
+def save_subject_cache(cache_dir, subject_path, signals, chest_labels):
+    # Write into a fresh temp dir first so an interrupted run never leaves
+    # a half-written (or mixed old/new) cache behind
+    tmp_dir = cache_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    for k, v in signals.items():
+        np.save(os.path.join(tmp_dir, f"{k}.npy"), np.ascontiguousarray(v))
+    np.save(os.path.join(tmp_dir, "label.npy"), chest_labels)
+    with open(os.path.join(tmp_dir, CACHE_STAMP), "w") as f:
+        f.write(pickle_stamp(subject_path))
+
+    # Replaces a stale cache from an older pickle, if any
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.replace(tmp_dir, cache_dir)
+
+
+def load_subject_cache(cache_dir, subject_path):
+    # Cache miss (None) when missing, incomplete or built from another pickle
+    stamp_path = os.path.join(cache_dir, CACHE_STAMP)
+    if not (os.path.isfile(stamp_path)
+            and os.path.isfile(os.path.join(cache_dir, "label.npy"))):
+        return None
+    with open(stamp_path) as f:
+        if f.read() != pickle_stamp(subject_path):
+            return None
+
+    # Memory-mapped, so windows are read straight from the page cache
+    signals = {
+        os.path.splitext(f)[0]: np.load(os.path.join(cache_dir, f), mmap_mode="r")
+        for f in sorted(os.listdir(cache_dir))
+        if f.endswith(".npy")
+    }
+    chest_labels = signals.pop("label")
+
+    return signals, chest_labels
+
+
 # ----------------------------
 # FREQUENCY-DOMAIN HELPERS
 # ----------------------------
 
-def bandpower(arr, fs, low, high):
-    # Use nperseg = len(arr) to remove warnings
-    freqs, psd = signal.welch(arr, fs=fs, nperseg=len(arr))
+def batched_psd(W, fs):
+    # Same periodogram welch() produces with nperseg = window length
+    # (hann window, constant detrend, one-sided density), computed for
+    # every window of W with one rfft call
+    nperseg = W.shape[1]
+    win = signal.get_window("hann", nperseg)
+
+    spec = np.fft.rfft((W - W.mean(axis=1, keepdims=True)) * win, axis=1)
+    psd = (spec.real ** 2 + spec.imag ** 2) / (fs * (win ** 2).sum())
+    if nperseg % 2:
+        psd[:, 1:] *= 2
+    else:
+        psd[:, 1:-1] *= 2
+
+    return psd
 
-    mask = (freqs >= low) & (freqs <= high)
+
+def batched_bandpower(psd, fs, nperseg, low, high):
+    band_freqs, mask = band_mask(fs, nperseg, low, high)
     if not np.any(mask):
-        return 0.0
-    return float(trapezoid(psd[mask], freqs[mask]))
+        return np.zeros(len(psd))
+    return trapezoid(psd[:, mask], band_freqs, axis=1)
 
 
 # ----------------------------
 # FEATURE EXTRACTION
 # ----------------------------
+
+def stats_block(W):  # All of the signals have these features
+    # One reduction per statistic over the (n_windows, window) matrix;
+    # ddof / bias match the pandas Series defaults used originally
+    return (
+        W.mean(axis=1),
+        W.std(axis=1, ddof=1),
+        W.min(axis=1),
+        W.max(axis=1),
+        np.median(W, axis=1),
+        skew(W, axis=1, bias=False),
+        kurtosis(W, axis=1, bias=False),
+    )
+
+
+def hrv_window_features(bvp):
+    # Peak detection + time-domain HRV in one compiled pass
+    hr, sdnn, rmssd, pnn50, ibi = hrv_features(
+        bvp, float(DEFAULT_BVP_SR), int(DEFAULT_BVP_SR * 0.3)
+    )
+
+    if len(ibi) > 0:
+        # frequency-domain HRV (LF/HF)
+        # Interpolate IBIs to uniform time grid. IBIs are multiples of
+        # 1/fs, so sdnn < 1ms only when they are all equal and the
+        # resampling would return ibi unchanged
+        try:
+            if sdnn < 1e-3:
+                ibi_interp = ibi
+            else:
+                times = np.cumsum(ibi)
+                interp_times = np.linspace(times[0], times[-1], len(times))
+                ibi_interp = np.interp(interp_times, times, ibi)
+
+            LF = bandpower(ibi_interp, 4, 0.04, 0.15)
+            HF = bandpower(ibi_interp, 4, 0.15, 0.4)
+            LFHF = LF / HF if HF > 0 else 0
+        except:
+            LF = HF = LFHF = 0
+
+    else:
+        hr = sdnn = rmssd = pnn50 = LF = HF = LFHF = 0
+
+    return hr, sdnn, rmssd, pnn50, LF, HF, LFHF
+
+
 def extract_window_features(signals, chest_labels, sr, window_samples, step_samples):
 
-    features = []
     n = min(len(v) for v in signals.values())
     chest_len = len(chest_labels)
     scale = chest_len / n  # mapping wrist index → chest label index
 
-    for start in range(0, n - window_samples + 1, step_samples):
-        end = start + window_samples
-        row = {}
-
-        def stats_dict(arr):  # All of the signals have these features
-            s = pd.Series(arr)
-            return {
-                "mean": float(s.mean()),
-                "std": float(s.std()),
-                "min": float(s.min()),
-                "max": float(s.max()),
-                "median": float(s.median()),
-                "skew": float(s.skew()),
-                "kurt": float(s.kurt()),
-            }
-
-        def valid(arr):
-            return not (np.isnan(arr).any() or np.isinf(arr).any() or np.std(arr) == 0)
-
-        # ---------------- EDA FEATURES ----------------
-        if "EDA" in signals:
-            eda = signals["EDA"][start:end]
-            if not valid(eda):
-                continue
-
-            row.update({f"EDA_{k}": v for k, v in stats_dict(eda).items()})
-
-            # EDA derivative
-            eda_diff = np.diff(eda)
-            row["EDA_diff_mean"] = float(np.mean(eda_diff))
-            row["EDA_diff_std"] = float(np.std(eda_diff))
-
-            # EDA peaks (simple SCR estimate)
-            peaks, _ = signal.find_peaks(eda, distance=int(sr * 0.5))
-            row["EDA_peak_count"] = len(peaks)
-            row["EDA_peak_mean_amp"] = float(np.mean(eda[peaks])) if len(peaks) > 0 else 0.0
-
-            # EDA frequency domain (stress increases high-frequency)
-            row["EDA_LF"] = bandpower(eda, sr, 0.01, 0.1)
-            row["EDA_HF"] = bandpower(eda, sr, 0.1, 0.25)
-            row["EDA_LFHF"] = (
-                row["EDA_LF"] / row["EDA_HF"] if row["EDA_HF"] > 0 else 0
-            )
-
-        # ---------------- TEMP FEATURES ----------------
-        if "TEMP" in signals:
-            temp = signals["TEMP"][start:end]
-            if not valid(temp):
-                continue
-
-            row.update({f"TEMP_{k}": v for k, v in stats_dict(temp).items()})
-            row["TEMP_slope"] = (temp[-1] - temp[0]) / len(temp)
-
-        # ---------------- ACC FEATURES ----------------
-        if all(k in signals for k in ["ACC_x", "ACC_y", "ACC_z"]):
-            ax = signals["ACC_x"][start:end]
-            ay = signals["ACC_y"][start:end]
-            az = signals["ACC_z"][start:end]
-
-            mag = np.sqrt(ax ** 2 + ay ** 2 + az ** 2)
-            if not valid(mag):
-                continue
-
-            row.update({f"ACC_mag_{k}": v for k, v in stats_dict(mag).items()})
-            row["ACC_energy"] = float(np.sum(mag ** 2) / len(mag))
-
-        # ---------------- BVP (PPG) + HRV FEATURES ----------------
-        if "BVP" in signals:
-            bvp_start = start * 2
-            bvp_end = end * 2
-            bvp = signals["BVP"][bvp_start:bvp_end]
-
-            if not valid(bvp):
-                continue
-
-            row.update({f"BVP_{k}": v for k, v in stats_dict(bvp).items()})
-
-            # Peak detection for HRV
-            peaks, _ = signal.find_peaks(bvp, distance=int(DEFAULT_BVP_SR * 0.3))
-
-            if len(peaks) > 1:
-                ibi = np.diff(peaks) / DEFAULT_BVP_SR  # RR intervals in seconds
-                rr_diff = np.diff(ibi)
-
-                hr = 60.0 / np.mean(ibi)
-                sdnn = np.std(ibi)
-                rmssd = np.sqrt(np.mean(rr_diff ** 2)) if len(rr_diff) > 0 else 0
-                nn50 = np.sum(np.abs(rr_diff) > 0.05)
-                pnn50 = nn50 / len(rr_diff) if len(rr_diff) > 0 else 0
-
-                # frequency-domain HRV (LF/HF)
-                # Interpolate IBIs to uniform time grid
-                try:
-                    times = np.cumsum(ibi)
-                    interp_times = np.linspace(times[0], times[-1], len(times))
-                    ibi_interp = np.interp(interp_times, times, ibi)
-
-                    LF = bandpower(ibi_interp, 4, 0.04, 0.15)
-                    HF = bandpower(ibi_interp, 4, 0.15, 0.4)
-                    LFHF = LF / HF if HF > 0 else 0
-                except:
-                    LF = HF = LFHF = 0
+    n_windows = max((n - window_samples) // step_samples + 1, 0)
+
+    def windows(arr, size=window_samples, step=step_samples):
+        # (n_windows, size) strided view over the signal, no copy
+        if len(arr) < size:
+            return np.empty((0, size), dtype=float)
+        return sliding_window_view(arr, size)[::step]
+
+    def valid(W):
+        # finite and not constant; ptp is one min/max pass instead of a std
+        return np.isfinite(W).all(axis=1) & (np.ptp(W, axis=1) > 0)
+
+    # ---------------- WINDOWED VIEWS ----------------
+    views = {}
+    if "EDA" in signals:
+        views["EDA"] = windows(signals["EDA"])
+    if "TEMP" in signals:
+        views["TEMP"] = windows(signals["TEMP"])
+    if all(k in signals for k in ["ACC_x", "ACC_y", "ACC_z"]):
+        views["ACC"] = windows(acc_magnitude(
+            signals["ACC_x"][:n], signals["ACC_y"][:n], signals["ACC_z"][:n]
+        ))
+    if "BVP" in signals:
+        # BVP is sampled twice as fast as the other wrist signals
+        views["BVP"] = windows(signals["BVP"], 2 * window_samples, 2 * step_samples)
+
+    n_windows = min([n_windows] + [len(W) for W in views.values()])
+    views = {k: W[:n_windows] for k, W in views.items()}
+
+    keep = np.ones(n_windows, dtype=bool)
+    for W in views.values():
+        keep &= valid(W)
+
+    # ---------------- LABEL ALIGNMENT ----------------
+    # Chest-label span of every window, computed once as index arrays
+    starts = np.arange(n_windows) * step_samples
+    c_starts = (starts * scale).astype(np.int64)
+    c_ends = np.minimum(((starts + window_samples) * scale).astype(np.int64), chest_len)
+
+    labels = np.full(n_windows, -1)
+    for i in np.flatnonzero(keep):
+        lbl = chest_labels[c_starts[i]:c_ends[i]]
+        if len(lbl) > 0:
+            m = np.bincount(lbl).argmax()  # labels are small non-negative ints
+            if m in ALLOWED_LABELS:
+                labels[i] = int(m)
+
+    keep &= labels >= 0
+    views = {k: W[keep] for k, W in views.items()}
+    cols = {}
 
-            else:
-                hr = sdnn = rmssd = pnn50 = LF = HF = LFHF = 0
+    # ---------------- EDA FEATURES ----------------
+    if "EDA" in views:
+        eda = views["EDA"]
+        cols.update(zip([f"EDA_{k}" for k in STAT_NAMES], stats_block(eda)))
 
-            row["HR_mean"] = hr
-            row["HRV_SDNN"] = sdnn
-            row["HRV_RMSSD"] = rmssd
-            row["HRV_pNN50"] = pnn50
-            row["HRV_LF"] = LF
-            row["HRV_HF"] = HF
-            row["HRV_LFHF"] = LFHF
+        # EDA derivative
+        cols["EDA_diff_mean"], cols["EDA_diff_std"] = window_diff_stats(eda)
 
-        # ---------------- LABEL ALIGNMENT ----------------
-        c_start = int(start * scale)
-        c_end = min(int(end * scale), chest_len)
+        # EDA peaks (simple SCR estimate)
+        cols["EDA_peak_count"], cols["EDA_peak_mean_amp"] = window_peak_stats(
+            np.ascontiguousarray(eda), int(sr * 0.5)
+        )
 
-        lbl = chest_labels[c_start:c_end]
-        if len(lbl) > 0:
-            m = pd.Series(lbl).mode().iloc[0]
-            if m in ALLOWED_LABELS:
-                row["label"] = int(m)
+        # EDA frequency domain (stress increases high-frequency)
+        psd = batched_psd(eda, sr)
+        cols["EDA_LF"] = batched_bandpower(psd, sr, window_samples, 0.01, 0.1)
+        cols["EDA_HF"] = batched_bandpower(psd, sr, window_samples, 0.1, 0.25)
+        cols["EDA_LFHF"] = np.divide(
+            cols["EDA_LF"], cols["EDA_HF"],
+            out=np.zeros(len(eda)), where=cols["EDA_HF"] > 0
+        )
+
+    # ---------------- TEMP FEATURES ----------------
+    if "TEMP" in views:
+        temp = views["TEMP"]
+        cols.update(zip([f"TEMP_{k}" for k in STAT_NAMES], stats_block(temp)))
+        cols["TEMP_slope"] = (temp[:, -1] - temp[:, 0]) / window_samples
+
+    # ---------------- ACC FEATURES ----------------
+    if "ACC" in views:
+        mag = views["ACC"]
+        cols.update(zip([f"ACC_mag_{k}" for k in STAT_NAMES], stats_block(mag)))
+        cols["ACC_energy"] = np.sum(mag ** 2, axis=1) / window_samples
 
-        if "label" in row:
-            features.append(row)
+    # ---------------- BVP (PPG) + HRV FEATURES ----------------
+    if "BVP" in views:
+        bvp = views["BVP"]
+        cols.update(zip([f"BVP_{k}" for k in STAT_NAMES], stats_block(bvp)))
 
-    return features
+        hrv = np.array([hrv_window_features(w) for w in bvp], dtype=float).reshape(-1, 7)
+        for j, k in enumerate(["HR_mean", "HRV_SDNN", "HRV_RMSSD", "HRV_pNN50",
+                               "HRV_LF", "HRV_HF", "HRV_LFHF"]):
+            cols[k] = hrv[:, j]
+
+    # Features of missing signals stay NaN and are dropped in main()
+    out = np.full((int(keep.sum()), len(FEATURE_COLS)), np.nan, dtype=np.float32)
+    for j, k in enumerate(FEATURE_COLS):
+        if k in cols:
+            out[:, j] = cols[k]
+
+    return out, labels[keep]
 
 
 # ----------------------------
 # MAIN PIPELINE
 # ----------------------------
+def process_subject(path, window_samples, step_samples):
+    safe_print(f"\nProcessing {path} ...")
+    res = load_wesad_subject(path)
+    if res is None:
+        return None
+
+    signals, labels = res
+    feats, window_labels = extract_window_features(
+        signals, labels, DEFAULT_WRIST_SR, window_samples, step_samples
+    )
+    safe_print(f"Extracted {len(feats)} windows.")
+    return feats, window_labels
+
+
+def subject_frame(path, window_samples, step_samples):
+    # One dask partition: the subject's windows as a DataFrame
+    res = process_subject(path, window_samples, step_samples)
+    if res is None:
+        return feature_schema()
+
+    feats, window_labels = res
+    df = pd.DataFrame(feats, columns=FEATURE_COLS)
+    df["label"] = window_labels.astype(np.int64)
+    return df
+
+
+def feature_schema():
+    df = pd.DataFrame({c: pd.Series(dtype=np.float32) for c in FEATURE_COLS})
+    df["label"] = pd.Series(dtype=np.int64)
+    return df
+
+
+def check_features_dir(path):
+    # to_parquet(overwrite=True) deletes the whole directory first, so only
+    # allow that for a directory this pipeline wrote itself
+    if not os.path.isdir(path):
+        return
+    foreign = [
+        f for f in os.listdir(path)
+        if not (re.fullmatch(r"part\.\d+\.parquet", f)
+                or f in ("_metadata", "_common_metadata"))
+    ]
+    if foreign:
+        raise RuntimeError(
+            f"{path} contains files not written by the dask pipeline "
+            f"({', '.join(sorted(foreign)[:5])}); refusing to overwrite it."
+        )
+
+
+def build_dataset_dask(subject_paths, window_samples, step_samples):
+    import dask.dataframe as dd
+
+    check_features_dir(FEATURES_DIR)
+
+    # One partition per subject; runs on the local scheduler unless a
+    # dask.distributed Client is active
+    ddf = dd.from_map(
+        subject_frame, subject_paths,
+        window_samples=window_samples, step_samples=step_samples,
+        meta=feature_schema(),
+    )
+    # Zero-padded part names keep the subjects in order when read back
+    ddf.to_parquet(
+        FEATURES_DIR, write_index=False, overwrite=True,
+        name_function=lambda i: f"part.{i:05d}.parquet",
+    )
+
+    return pd.read_parquet(FEATURES_DIR)
+
+
+def build_dataset(subject_paths, window_samples, step_samples):
+    # Subjects are independent, so each one runs in its own worker process
+    results = Parallel(n_jobs=N_JOBS, backend="loky")(
+        delayed(process_subject)(path, window_samples, step_samples)
+        for path in subject_paths
+    )
+    results = [res for res in results if res is not None]
+
+    # Subject blocks are already float32; stack them once
+    features = np.concatenate(
+        [np.empty((0, len(FEATURE_COLS)), dtype=np.float32)]
+        + [feats for feats, _ in results]
+    )
+    labels = np.concatenate(
+        [np.empty(0, dtype=int)] + [window_labels for _, window_labels in results]
+    )
+
+    df = pd.DataFrame(features, columns=FEATURE_COLS, copy=False)
+    df["label"] = labels
+    return df
+
+
 def main():
     subject_paths = glob.glob(os.path.join(WESAD_PATH, "S*", "S*.pkl"))
     safe_print(f"Found {len(subject_paths)} subjects.")
@@ -232,26 +439,17 @@ def main():
     WINDOW = int(WINDOW_SECONDS * DEFAULT_WRIST_SR)
     STEP = int(WINDOW_STEP_SECONDS * DEFAULT_WRIST_SR)
 
-    all_rows = []
-
-    for path in subject_paths:
-        safe_print(f"\nProcessing {path} ...")
-        res = load_wesad_subject(path)
-        if res is None:
-            continue
-
-        signals, labels = res
-        feats = extract_window_features(
-            signals, labels, DEFAULT_WRIST_SR, WINDOW, STEP
-        )
-        safe_print(f"Extracted {len(feats)} windows.")
-        all_rows.extend(feats)
+    if USE_DASK:
+        df = build_dataset_dask(subject_paths, WINDOW, STEP)
+    else:
+        df = build_dataset(subject_paths, WINDOW, STEP)
 
-    df = pd.DataFrame(all_rows).dropna().reset_index()
+    df = df.dropna().reset_index()
     safe_print(f"\nFinal dataset shape: {df.shape}")
     safe_print(df["label"].value_counts())
 
     X = df.drop("label", axis=1)
+    X = X.astype(np.float32)  # CatBoost takes float32 as is, no float64 copy
     y = df["label"]
 
     X_train, X_test, y_train, y_test = train_test_split(
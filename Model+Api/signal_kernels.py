@@ -0,0 +1,279 @@
+# ==========================
+# Signal kernels and helpers shared by training and the API
+# ==========================
+
+from functools import lru_cache
+
+import numpy as np
+from numba import njit
+from scipy import signal
+from scipy.integrate import trapezoid
+
+
+# =========================================================
+# Feature columns
+# =========================================================
+STAT_NAMES = ["mean", "std", "min", "max", "median", "skew", "kurt"]
+
+# Column order of the training matrix; api.py prepends 'index' to it, so
+# both scripts always agree on the position of every feature
+FEATURE_COLS = (
+    [f"EDA_{k}" for k in STAT_NAMES]
+    + ["EDA_diff_mean", "EDA_diff_std", "EDA_peak_count", "EDA_peak_mean_amp",
+       "EDA_LF", "EDA_HF", "EDA_LFHF"]
+    + [f"TEMP_{k}" for k in STAT_NAMES] + ["TEMP_slope"]
+    + [f"ACC_mag_{k}" for k in STAT_NAMES] + ["ACC_energy"]
+    + [f"BVP_{k}" for k in STAT_NAMES]
+    + ["HR_mean", "HRV_SDNN", "HRV_RMSSD", "HRV_pNN50", "HRV_LF", "HRV_HF", "HRV_LFHF"]
+)
+
+
+# =========================================================
+# Band power
+# =========================================================
+@lru_cache(maxsize=None)
+def band_mask(fs, nperseg, low, high):
+    # The frequency grid only depends on (fs, nperseg), so each band's
+    # mask is built once and reused for every window
+    freqs = np.fft.rfftfreq(nperseg, 1 / fs)
+    mask = (freqs >= low) & (freqs <= high)
+    band_freqs = freqs[mask]
+    mask.flags.writeable = False
+    band_freqs.flags.writeable = False
+    return band_freqs, mask
+
+
+def bandpower(arr, fs, low, high):
+    band_freqs, mask = band_mask(fs, len(arr), low, high)
+    if not np.any(mask):
+        return 0.0
+
+    # Use nperseg = len(arr) to remove warnings
+    _, psd = signal.welch(arr, fs=fs, nperseg=len(arr))
+    return float(trapezoid(psd[mask], band_freqs))
+
+
+# Sample rates and peak distances are passed as ordinary runtime arguments.
+# numba.literally() would bake them in as constants, but it re-runs literal
+# dispatch on every call made from Python (tens of ms per call, against a
+# few us here), and window length / step only reach the kernels as array
+# shapes, so there is nothing further to specialize on.
+
+
+# =========================================================
+# Peak detection
+# =========================================================
+@njit(cache=True)
+def find_peaks_distance(x, distance):
+    """
+    Same result as scipy.signal.find_peaks(x, distance=distance):
+    local maxima (flat peaks reduced to their midpoint), then the
+    highest peaks win when two are closer than `distance` samples.
+    Peaks of exactly equal height are ranked by position (stable sort).
+    """
+    n = x.shape[0]
+    peaks = np.empty(n // 2, dtype=np.int32)
+    m = 0
+
+    i = 1
+    i_max = n - 1
+    while i < i_max:
+        if x[i - 1] < x[i]:
+            i_ahead = i + 1
+            while i_ahead < i_max and x[i_ahead] == x[i]:
+                i_ahead += 1
+            if x[i_ahead] < x[i]:
+                peaks[m] = (i + i_ahead - 1) // 2
+                m += 1
+                i = i_ahead
+        i += 1
+
+    peaks = peaks[:m]
+    if m < 2 or distance <= 1:
+        return peaks
+
+    heights = np.empty(m)
+    for j in range(m):
+        heights[j] = x[peaks[j]]
+    order = np.argsort(heights, kind="mergesort")
+
+    keep = np.ones(m, dtype=np.bool_)
+    for i in range(m - 1, -1, -1):
+        j = order[i]
+        if not keep[j]:
+            continue
+        k = j - 1
+        while k >= 0 and peaks[j] - peaks[k] < distance:
+            keep[k] = False
+            k -= 1
+        k = j + 1
+        while k < m and peaks[k] - peaks[j] < distance:
+            keep[k] = False
+            k += 1
+
+    return peaks[keep]
+
+
+@njit(cache=True)
+def window_peak_stats(W, distance):
+    """
+    Peak count and mean peak amplitude for every row of a
+    (n_windows, window) matrix, 0 amplitude when a row has no peaks.
+    """
+    n_windows = W.shape[0]
+    counts = np.zeros(n_windows, dtype=np.int64)
+    amps = np.zeros(n_windows)
+    for w in range(n_windows):
+        x = W[w]
+        peaks = find_peaks_distance(x, distance)
+        m = peaks.shape[0]
+        if m > 0:
+            s = 0.0
+            for j in range(m):
+                s += x[peaks[j]]
+            counts[w] = m
+            amps[w] = s / m
+    return counts, amps
+
+
+# =========================================================
+# First-difference statistics
+# =========================================================
+@njit(cache=True)
+def diff_mean_std(x):
+    """
+    Mean and population std of np.diff(x), streamed with Welford's
+    update so the difference array is never materialized.
+    """
+    n = 0
+    mean = 0.0
+    m2 = 0.0
+    for i in range(1, x.shape[0]):
+        d = x[i] - x[i - 1]
+        n += 1
+        delta = d - mean
+        mean += delta / n
+        m2 += delta * (d - mean)
+    if n == 0:
+        return np.nan, np.nan
+    return mean, np.sqrt(m2 / n)
+
+
+@njit(cache=True)
+def window_diff_stats(W):
+    """diff_mean_std for every row of a (n_windows, window) matrix."""
+    n_windows = W.shape[0]
+    means = np.empty(n_windows)
+    stds = np.empty(n_windows)
+    for w in range(n_windows):
+        means[w], stds[w] = diff_mean_std(W[w])
+    return means, stds
+
+
+# =========================================================
+# ACC magnitude
+# =========================================================
+@njit(cache=True, fastmath=True)
+def acc_magnitude(ax, ay, az):
+    """
+    sqrt(ax**2 + ay**2 + az**2) written straight into one output array,
+    without the squared / summed temporaries.
+    """
+    n = min(ax.shape[0], ay.shape[0], az.shape[0])
+    mag = np.empty(n)
+    for i in range(n):
+        mag[i] = np.sqrt(ax[i] * ax[i] + ay[i] * ay[i] + az[i] * az[i])
+    return mag
+
+
+@njit(cache=True)
+def acc_mag_stats(ax, ay, az):
+    """
+    Returns (mean, std, min, max, median, skew, kurt, energy) of the ACC
+    magnitude. std / skew / kurt are the population versions, like
+    np.std and scipy.stats.skew / kurtosis with their defaults.
+    """
+    n = min(ax.shape[0], ay.shape[0], az.shape[0])
+    mag = np.empty(n)
+    s = 0.0
+    sq = 0.0
+    mn = np.inf
+    mx = -np.inf
+    for i in range(n):
+        m = np.sqrt(ax[i] * ax[i] + ay[i] * ay[i] + az[i] * az[i])
+        mag[i] = m
+        s += m
+        sq += m * m
+        if m < mn:
+            mn = m
+        if m > mx:
+            mx = m
+    mean = s / n
+
+    m2 = 0.0
+    m3 = 0.0
+    m4 = 0.0
+    for i in range(n):
+        d = mag[i] - mean
+        d2 = d * d
+        m2 += d2
+        m3 += d2 * d
+        m4 += d2 * d2
+    m2 /= n
+    m3 /= n
+    m4 /= n
+
+    if m2 > 0.0:
+        sk = m3 / m2 ** 1.5
+        ku = m4 / (m2 * m2) - 3.0
+    else:
+        sk = np.nan
+        ku = np.nan
+
+    return mean, np.sqrt(m2), mn, mx, np.median(mag), sk, ku, sq / n
+
+
+# =========================================================
+# HRV (BVP peaks -> IBI -> HR / SDNN / RMSSD / pNN50)
+# =========================================================
+@njit(cache=True, fastmath=True)
+def hrv_features(bvp, fs, min_dist):
+    """
+    Returns (hr, sdnn, rmssd, pnn50, ibi) for one BVP window.
+    All values are 0 and ibi is empty when fewer than two beats are found.
+    """
+    peaks = find_peaks_distance(bvp, min_dist)
+    n_ibi = peaks.shape[0] - 1
+    if n_ibi < 1:
+        return 0.0, 0.0, 0.0, 0.0, np.empty(0)
+
+    # RR intervals in seconds
+    ibi = np.empty(n_ibi)
+    s = 0.0
+    for i in range(n_ibi):
+        ibi[i] = (peaks[i + 1] - peaks[i]) / fs
+        s += ibi[i]
+    mean = s / n_ibi
+
+    s2 = 0.0
+    for i in range(n_ibi):
+        d = ibi[i] - mean
+        s2 += d * d
+
+    hr = 60.0 / mean
+    sdnn = np.sqrt(s2 / n_ibi)
+
+    rmssd = 0.0
+    pnn50 = 0.0
+    if n_ibi > 1:
+        sq = 0.0
+        nn50 = 0
+        for i in range(n_ibi - 1):
+            d = ibi[i + 1] - ibi[i]
+            sq += d * d
+            if abs(d) > 0.05:
+                nn50 += 1
+        rmssd = np.sqrt(sq / (n_ibi - 1))
+        pnn50 = nn50 / (n_ibi - 1)
+
+    return hr, sdnn, rmssd, pnn50, ibi